@@ -12,24 +12,35 @@ Características:
 - Interfaz enriquecida con Rich
 """
 
+import asyncio
+import functools
+import io
 import os
 import time
 from pathlib import Path
-from typing import Any, Dict, List, TypedDict
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, TypedDict
 
 import typer
 from rich.console import Console
-from rich.markdown import Markdown
 from rich.panel import Panel
-from rich.status import Status
 
 from chat_db import add_message, get_all_messages
-from groq_client import stream_response
+from groq_client import close_client, stream_response
+
+try:
+    from exporter import convert_md_to_pdf, export_markdown_to
+    _EXPORTER_ERROR: Optional[ImportError] = None
+except ImportError as e:
+    _EXPORTER_ERROR = e
+
+if TYPE_CHECKING:
+    # rich.markdown arrastra el parser de markdown; se importa solo al renderizar
+    from rich.markdown import Markdown
 
 
 # Definición de tipo para la configuración
 class ConfigDict(TypedDict):
-    max_chunk_size: int
+    flush_size: int
     default_model: str
     default_temperature: float
     default_max_tokens: int
@@ -39,7 +50,7 @@ class ConfigDict(TypedDict):
 
 # Configuración
 CONFIG: ConfigDict = {
-    'max_chunk_size': 200,  # palabras por chunk (ahora más largo para respuestas fluidas)
+    'flush_size': 256,  # caracteres acumulados antes de emitir un chunk
     'default_model': os.environ.get('DEFAULT_MODEL', 'meta-llama/llama-4-scout-17b-16e-instruct'),
     'default_temperature': float(os.environ.get('DEFAULT_TEMPERATURE', 0.3)),
     'default_max_tokens': int(os.environ.get('DEFAULT_MAX_TOKENS', 8192)),  # Máximo soportado por el modelo
@@ -70,7 +81,7 @@ def display_welcome() -> None:
     console.print(Panel.fit(welcome_msg, style="blue"))
 
 
-def process_stream(
+async def process_stream_async(
     messages: List[Dict[str, str]],
     model: str = "meta-llama/llama-4-scout-17b-16e-instruct",
     max_tokens: int = 8192,  # Máximo soportado por el modelo
@@ -78,6 +89,9 @@ def process_stream(
 ) -> tuple[str, Dict[str, Any]]:
     """
     Procesa el stream de respuesta con manejo de chunks controlados.
+
+    Consume el stream de forma asíncrona para no bloquear el event loop
+    mientras se esperan los fragmentos de la red.
     
     Args:
         messages: Historial de mensajes
@@ -88,56 +102,63 @@ def process_stream(
     Returns:
         Tupla con (respuesta_completa, metadatos)
     """
-    console = Console()
-    full_response = []
-    current_chunk = []
-    chunk_count = 0
+    flush_size = CONFIG['flush_size']
+    full_response = io.StringIO()
+    tokens = 0
     start_time = time.time()
 
-    # Mostrar estado inicial
-    with Status("[bold green]Generando respuesta...[/bold green]") as status:
-        try:
+    try:
+        # El spinner solo cubre la espera del stream: se detiene antes de
+        # imprimir nada para que su hilo de refresco no compita con la salida
+        error = None
+        with console.status("[bold green]Generando respuesta...[/bold green]", refresh_per_second=4):
             # Configurar el stream
             stream = stream_response(
                 messages=messages,
                 model=model,
                 max_tokens=max_tokens,
                 temperature=temperature,
-                chunk_size=int(CONFIG['max_chunk_size']),
+                flush_size=flush_size,
                 on_chunk=on_chunk_callback
             )
 
             # Procesar cada chunk
-            for chunk_data in stream:
+            async for chunk_data in stream:
                 if chunk_data.get('error'):
-                    console.print(f"[red]Error: {chunk_data['error']}")
+                    error = chunk_data['error']
                     break
 
-                chunk = chunk_data['chunk']
-                current_chunk.append(chunk)
-                full_response.append(chunk)
-
-            # Mostrar la respuesta final en un panel limpio
-            respuesta_final = ''.join(full_response).strip()
-            if respuesta_final:
-                console.print(Panel(respuesta_final, title="🤖 Respuesta del Asistente", border_style="magenta", expand=False))
-
-            # Mostrar resumen
-            end_time = time.time()
-            console.print(f"\n[dim]Tiempo de generación: {end_time - start_time:.2f}s[/dim]")
-
-            return respuesta_final, {
-                'model': model,
-                'tokens': chunk_data.get('usage', {}).get('total_tokens', 0) if 'chunk_data' in locals() else 0,
-                'time_elapsed': end_time - start_time
-            }
-
-        except KeyboardInterrupt:
-            console.print("\n[red]Generación interrumpida por el usuario")
-            return ''.join(full_response), {'interrupted': True}
-        except Exception as e:
-            console.print(f"[red]Error durante la generación: {str(e)}")
-            return ''.join(full_response), {'error': str(e)}
+                full_response.write(chunk_data['chunk'])
+                if usage := chunk_data.get('usage'):
+                    tokens = usage.get('total_tokens', 0)
+
+        if error:
+            console.print(f"[red]Error: {error}")
+
+        # Mostrar la respuesta final en un panel limpio. Se renderiza como
+        # Markdown en lugar de texto con markup de Rich: los corchetes del
+        # código (p. ej. `list[int]`) no se interpretan como etiquetas.
+        respuesta_final = full_response.getvalue().strip()
+        if respuesta_final:
+            from rich.markdown import Markdown
+            console.print(Panel(Markdown(respuesta_final), title="🤖 Respuesta del Asistente", border_style="magenta", expand=False))
+
+        # Mostrar resumen
+        end_time = time.time()
+        console.print(f"\n[dim]Tiempo de generación: {end_time - start_time:.2f}s[/dim]")
+
+        return respuesta_final, {
+            'model': model,
+            'tokens': tokens,
+            'time_elapsed': end_time - start_time
+        }
+
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        console.print("\n[red]Generación interrumpida por el usuario")
+        return full_response.getvalue(), {'interrupted': True}
+    except Exception as e:
+        console.print(f"[red]Error durante la generación: {str(e)}")
+        return full_response.getvalue(), {'error': str(e)}
 
 def on_chunk_callback(chunk: str, finished: bool, metadata: Dict) -> bool:
     """Callback para procesar cada chunk de la respuesta.
@@ -155,6 +176,22 @@ def on_chunk_callback(chunk: str, finished: bool, metadata: Dict) -> bool:
     return True  # Continuar con el stream
 
 
+@functools.lru_cache(maxsize=512)
+def _rendered_markdown(message_id: int, content: str) -> "Markdown":
+    """Devuelve el Markdown de un mensaje, reutilizándolo entre llamadas.
+
+    Args:
+        message_id: Identificador del mensaje
+        content: Contenido del mensaje
+
+    Returns:
+        Markdown: Objeto ya parseado listo para imprimir
+    """
+    from rich.markdown import Markdown
+
+    return Markdown(content)
+
+
 def ensure_export_dir() -> Path:
     """Asegura que exista el directorio de exportación.
     
@@ -191,6 +228,52 @@ def ask(
     if question.lower() in ("exit", "quit", "salir"):
         raise typer.Exit()
 
+    if not ask_handler(question, temperature=temperature, max_tokens=max_tokens, model=model):
+        raise typer.Exit(1)
+
+
+def ask_handler(query: str, temperature: float, max_tokens: int, model: str) -> bool:
+    """Procesa una pregunta sin pasar por el parser de la CLI.
+
+    Es el punto de entrada síncrono del comando `ask`: abre su propio event
+    loop. El modo interactivo, que mantiene un loop para toda la sesión,
+    llama directamente a `ask_async`.
+
+    Args:
+        query: Pregunta para el asistente
+        temperature: Temperatura para la generación (0.0-1.0)
+        max_tokens: Número máximo de tokens a generar
+        model: Modelo a utilizar
+
+    Returns:
+        bool: True si la pregunta se procesó, False si hubo un error (ya mostrado)
+    """
+    return asyncio.run(_run_ask(query, temperature=temperature, max_tokens=max_tokens, model=model))
+
+
+async def _run_ask(question: str, temperature: float, max_tokens: int, model: str) -> bool:
+    """Ejecuta `ask_async` y cierra después las conexiones del cliente de Groq."""
+    try:
+        return await ask_async(question, temperature=temperature, max_tokens=max_tokens, model=model)
+    finally:
+        await close_client()
+
+
+async def ask_async(question: str, temperature: float, max_tokens: int, model: str) -> bool:
+    """Cuerpo asíncrono del comando `ask`.
+
+    Puede llamarse varias veces dentro del mismo event loop (p. ej. desde el
+    modo interactivo) para reutilizar las conexiones del cliente de Groq.
+
+    Args:
+        question: Pregunta para el asistente
+        temperature: Temperatura para la generación (0.0-1.0)
+        max_tokens: Número máximo de tokens a generar
+        model: Modelo a utilizar
+
+    Returns:
+        bool: True si la pregunta se procesó, False si hubo un error (ya mostrado)
+    """
     try:
         # Añadir pregunta al historial
         add_message("user", question)
@@ -203,29 +286,28 @@ def ask(
         # los mensajes desde el último separador de conversación
         message_records, _ = get_all_messages(limit=20, current_conversation_only=True)
 
-        # Convertir registros a formato para la API
-        messages = []
-        for msg in message_records:
-            if isinstance(msg, dict):
-                role = "user" if msg.get("role") == "user" else "assistant"
-                content = msg.get("content", "")
-            else:
-                role = "user" if msg.role == "user" else "assistant"
-                content = msg.content
-
-            messages.append({"role": role, "content": content})
+        # Convertir registros a formato para la API (solo role y content)
+        messages = [
+            {"role": "user" if msg["role"] == "user" else "assistant", "content": msg["content"]}
+            for msg in message_records
+        ]
 
         # Procesar la respuesta con manejo de streaming
         console.print("[bold green]Asistente:[/bold green] ", end="")
 
         # Obtener la respuesta con streaming controlado
-        response, metadata = process_stream(
+        response, metadata = await process_stream_async(
             messages=messages,
             model=model,
             temperature=max(0, min(1, temperature)),  # Asegurar valor entre 0 y 1
             max_tokens=max_tokens,
         )
 
+        # Guardar la respuesta en la base de datos. add_message solo encola el
+        # mensaje, así que la inserción avanza mientras se imprime el resumen.
+        if not metadata.get('interrupted') and not metadata.get('error'):
+            add_message("assistant", response)
+
         # Mostrar resumen de uso si está habilitado
         if CONFIG['show_usage'] and 'tokens' in metadata:
             console.print(
@@ -233,13 +315,11 @@ def ask(
                 f"Tiempo: {metadata['time_elapsed']:.1f}s"
             )
 
-        # Guardar la respuesta en la base de datos
-        if not metadata.get('interrupted') and not metadata.get('error'):
-            add_message("assistant", response)
+        return True
 
     except Exception as e:
         console.print(f"[red]Error:[/] {str(e)}")
-        raise typer.Exit(1)
+        return False
 
 
 @app.command()
@@ -264,7 +344,7 @@ def history(
     """Muestra el historial de la conversación."""
     messages_result = get_all_messages()
     # Corregimos la anotación de tipo para coincidir con lo que devuelve get_all_messages
-    messages = messages_result[0]  # List[dict], no List[Message]
+    messages = messages_result[0]  # Filas como mapeos (msg['role'], msg['content'], ...)
 
     if not messages:
         console.print("[yellow]No hay historial de mensajes.[/]")
@@ -277,14 +357,9 @@ def history(
 
     for msg in messages:
         role_display = "👤 Tú" if msg['role'] == "user" else "🤖 Asistente"
-        # Convertir el timestamp ISO a objeto datetime si es un string
-        if isinstance(msg['created_at'], str):
-            from datetime import datetime
-            timestamp = datetime.fromisoformat(msg['created_at']).strftime("%Y-%m-%d %H:%M:%S")
-        else:
-            timestamp = msg['created_at'].strftime("%Y-%m-%d %H:%M:%S")
-        console.print(f"[dim]{timestamp}[/] - {role_display}:")
-        console.print(Markdown(msg['content']), justify="left")
+        # La fecha llega formateada desde la base de datos
+        console.print(f"[dim]{msg['ts']}[/] - {role_display}:")
+        console.print(_rendered_markdown(msg['id'], msg['content']), justify="left")
         console.print()  # Espacio entre mensajes
 
 
@@ -321,10 +396,8 @@ def export(
     
     Por defecto exporta a Markdown (.md). Para exportar a PDF se requiere Pandoc.
     """
-    try:
-        from exporter import convert_md_to_pdf, export_markdown
-    except ImportError as e:
-        console.print(f"[red]Error:[/] {e}")
+    if _EXPORTER_ERROR is not None:
+        console.print(f"[red]Error:[/] {_EXPORTER_ERROR}")
         console.print("Instala las dependencias necesarias con: pip install -r requirements.txt")
         raise typer.Exit(1)
 
@@ -334,7 +407,7 @@ def export(
         raise typer.Exit(1)
 
     # Obtener mensajes
-    messages = get_all_messages()
+    messages, _ = get_all_messages(limit=limit)
     if not messages:
         console.print("[yellow]No hay mensajes para exportar.[/]")
         return
@@ -345,15 +418,15 @@ def export(
     md_file = export_dir / f"{base_name}.md"
 
     try:
-        # Exportar a Markdown
-        md_content = export_markdown(messages)
-        md_file.write_text(md_content, encoding="utf-8")
+        # Exportar a Markdown escribiendo cada mensaje directamente al archivo
+        with md_file.open("w", encoding="utf-8", buffering=1 << 20) as fp:
+            export_markdown_to(messages, fp)
         console.print(f"✓ [green]Exportado:[/] {md_file.absolute()}")
 
         # Convertir a PDF si es necesario
         if format == "pdf":
             pdf_file = export_dir / f"{base_name}.pdf"
-            convert_md_to_pdf(str(md_file), str(pdf_file))
+            asyncio.run(convert_md_to_pdf(str(md_file), str(pdf_file)))
             console.print(f"✓ [green]Exportado:[/] {pdf_file.absolute()}")
 
     except Exception as e:
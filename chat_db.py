@@ -5,13 +5,31 @@ Este módulo maneja el almacenamiento y recuperación de mensajes del chat
 utilizando SQLAlchemy con PostgreSQL.
 """
 
+import atexit
 import os
+import queue
+import threading
 from contextlib import contextmanager
 from datetime import datetime, timezone
 from textwrap import fill
-from typing import Generator, List, Optional
-
-from sqlalchemy import Column, DateTime, Integer, String, Text, create_engine, func
+from typing import Any, Dict, Generator, List, Optional, Sequence
+
+from sqlalchemy import (
+    Boolean,
+    Column,
+    DateTime,
+    Index,
+    Integer,
+    Select,
+    String,
+    Text,
+    create_engine,
+    func,
+    insert,
+    select,
+    text,
+)
+from sqlalchemy.engine import RowMapping
 from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.orm import Session, declarative_base, sessionmaker
 
@@ -25,12 +43,22 @@ DB_NAME = os.getenv("DB_NAME", "chatdb")
 # Construir URL de conexión
 DATABASE_URL = f"postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
 
+# synchronous_commit de Postgres para las sesiones de la app (p. ej. "off"
+# evita esperar el fsync del WAL en cada commit). Sin definir, se usa el del servidor.
+DB_SYNCHRONOUS_COMMIT = os.getenv("DB_SYNCHRONOUS_COMMIT")
+_connect_args: Dict[str, Any] = {}
+if DB_SYNCHRONOUS_COMMIT:
+    _connect_args["options"] = f"-c synchronous_commit={DB_SYNCHRONOUS_COMMIT}"
+
 # Crear motor y sesión
 engine = create_engine(
     DATABASE_URL,
     echo=bool(os.getenv("SQL_ECHO", "False").lower() in ("true", "1", "yes")),  # Mejor manejo de variables booleanas
+    pool_size=5,  # Conexiones persistentes en el pool
+    max_overflow=10,  # Conexiones extra permitidas en picos
     pool_pre_ping=True,  # Verificar conexiones antes de usarlas
     pool_recycle=3600,  # Reciclar conexiones después de una hora
+    connect_args=_connect_args,
 )
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
@@ -50,13 +78,23 @@ class Message(Base):  # type: ignore
         role: Rol del emisor (user/assistant)
         content: Contenido del mensaje
         created_at: Fecha y hora de creación
+        is_separator: Si el mensaje marca el inicio de una nueva conversación
     """
     __tablename__ = "messages"
+    __table_args__ = (
+        # Índice parcial para localizar el último separador de conversación
+        Index(
+            "ix_messages_separator",
+            "created_at",
+            postgresql_where=text("is_separator"),
+        ),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     role = Column(String(20), nullable=False, index=True)  # user o assistant
     content = Column(Text, nullable=False)
     created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc), index=True)
+    is_separator = Column(Boolean, nullable=False, default=False, server_default=text("false"))
 
     def __repr__(self) -> str:
         return f"<Message(id={self.id}, role='{self.role}', created_at='{self.created_at}')>"
@@ -81,41 +119,120 @@ def get_db() -> Generator[Session, None, None]:
         db.close()
 
 
+# Escritura de mensajes en segundo plano
+_WRITE_BATCH_SIZE = 32  # máximo de mensajes por inserción
+_write_queue: "queue.Queue[Dict[str, Any]]" = queue.Queue()
+
+# Último error de escritura, pendiente de notificar al siguiente lector
+_write_error: Optional[Exception] = None
+_write_error_lock = threading.Lock()
+
+# INSERT precompilado; se ejecuta como executemany sin pasar por el ORM
+_INSERT_MESSAGE = insert(Message.__table__)
+
+
+def _message_writer() -> None:
+    """Consume la cola de escritura e inserta los mensajes en lotes.
+
+    El lote se forma con los mensajes ya encolados, sin esperar a que
+    lleguen más: un mensaje suelto se inserta de inmediato.
+    """
+    global _write_error
+
+    while True:
+        batch = [_write_queue.get()]
+        while len(batch) < _WRITE_BATCH_SIZE:
+            try:
+                batch.append(_write_queue.get_nowait())
+            except queue.Empty:
+                break
+
+        try:
+            with engine.begin() as conn:
+                conn.execute(_INSERT_MESSAGE, batch)
+        except Exception as e:
+            # Cualquier error (también los del driver, p. ej. ValueError por
+            # un carácter NUL) se guarda para el lector; el hilo sigue vivo
+            with _write_error_lock:
+                _write_error = e
+        finally:
+            for _ in batch:
+                _write_queue.task_done()
+
+
+def _wait_for_pending_writes() -> None:
+    """Bloquea hasta que todos los mensajes encolados se hayan insertado.
+
+    Raises:
+        Exception: El error de la última inserción fallida, si la hubo
+    """
+    global _write_error
+
+    _write_queue.join()
+
+    with _write_error_lock:
+        error, _write_error = _write_error, None
+    if error is not None:
+        raise error
+
+
+def _flush_pending_writes_at_exit() -> None:
+    """Espera las escrituras pendientes al salir, informando de los errores."""
+    try:
+        _wait_for_pending_writes()
+    except Exception as e:
+        print(f"Error al guardar mensajes: {str(e)}")
+
+
+threading.Thread(target=_message_writer, name="chat-db-writer", daemon=True).start()
+atexit.register(_flush_pending_writes_at_exit)
+
+
 def add_message(role: str, content: str) -> dict:
-    """Agrega un nuevo mensaje a la base de datos.
-    
+    """Encola un nuevo mensaje para guardarlo en la base de datos.
+
+    La inserción la realiza un hilo en segundo plano que agrupa los mensajes
+    en lotes, por lo que la función retorna sin esperar a la base de datos.
+    Las lecturas del historial esperan a que la cola se vacíe y relanzan el
+    error de la última inserción fallida.
+
     Args:
         role: Rol del emisor (user/assistant)
         content: Contenido del mensaje
-        
+
     Returns:
-        Un diccionario con los datos del mensaje creado
-        
+        Un diccionario con los datos del mensaje encolado (`id` es None
+        hasta que se inserta)
+
     Raises:
         ValueError: Si el rol o el contenido son inválidos
-        SQLAlchemyError: Si ocurre un error en la base de datos
     """
     if not role or not isinstance(role, str):
         raise ValueError("El rol es requerido y debe ser un string")
     if not content or not isinstance(content, str):
         raise ValueError("El contenido es requerido y debe ser un string")
 
-    try:
-        with get_db() as db:
-            message = Message(role=role.lower(), content=content)
-            db.add(message)
-            db.commit()
-
-            # Crear un diccionario con los datos del mensaje para evitar problemas de sesión
-            message_dict = {
-                "id": message.id,
-                "role": message.role,
-                "content": message.content,
-                "created_at": message.created_at.isoformat() if message.created_at else None
-            }
-            return message_dict
-    except SQLAlchemyError as e:
-        raise SQLAlchemyError(f"Error al agregar mensaje: {str(e)}")
+    role = role.lower()
+    now = datetime.now(timezone.utc)
+    _write_queue.put({"role": role, "content": content, "created_at": now})
+
+    return {
+        "id": None,
+        "role": role,
+        "content": content,
+        "created_at": now.isoformat(),
+    }
+
+
+def _last_separator_id():
+    """Subconsulta escalar con el id del último separador de conversación."""
+    return (
+        select(Message.id)
+        .where(Message.is_separator)
+        .order_by(Message.created_at.desc())
+        .limit(1)
+        .scalar_subquery()
+    )
 
 
 def get_all_messages(
@@ -124,7 +241,7 @@ def get_all_messages(
     search: Optional[str] = None,
     role: Optional[str] = None,
     current_conversation_only: bool = True
-) -> tuple[List[dict], int]:
+) -> tuple[Sequence[RowMapping], int]:
     """Obtiene mensajes del chat con opciones de paginación y búsqueda.
     
     Args:
@@ -135,62 +252,49 @@ def get_all_messages(
         current_conversation_only: Si es True, solo retorna mensajes de la conversación actual
         
     Returns:
-        Tupla con (lista_de_diccionarios_de_mensajes, total_de_mensajes)
+        Tupla con (filas_de_mensajes, total_de_mensajes). Cada fila es un mapeo
+        de solo lectura con las claves id, role, content, created_at, ts
+        (fecha formateada como 'YYYY-MM-DD HH:MM:SS') y total
         
     Raises:
         SQLAlchemyError: Si ocurre un error en la base de datos
     """
+    _wait_for_pending_writes()
+
     try:
         with get_db() as db:
-            # Si queremos solo la conversación actual, primero encontramos el último separador
-            last_separator_id = None
-            if current_conversation_only:
-                # Buscar el último separador (mensaje "system" que comienza con "--- NUEVA CONVERSACIÓN")
-                separator_query = (
-                    db.query(Message.id)
-                    .filter(Message.role == "system")
-                    .filter(Message.content.like("--- NUEVA CONVERSACIÓN%"))
-                    .order_by(Message.created_at.desc())
-                    .first()
-                )
-
-                if separator_query:
-                    last_separator_id = separator_query[0]
-
-            # Construir la consulta base
-            query = db.query(Message)
+            # Construir la consulta base. Se seleccionan columnas en lugar de
+            # entidades para no materializar objetos del ORM.
+            stmt = select(
+                Message.id,
+                Message.role,
+                Message.content,
+                Message.created_at,
+                # Fecha ya formateada por PostgreSQL para mostrarla en la terminal
+                func.to_char(Message.created_at, "YYYY-MM-DD HH24:MI:SS").label("ts"),
+                # El total de mensajes (para paginación) se obtiene en la misma
+                # consulta con COUNT(*) OVER()
+                func.count().over().label("total"),
+            )
 
-            # Filtrar mensajes por conversación actual si es necesario
-            if current_conversation_only and last_separator_id:
-                query = query.filter(Message.id >= last_separator_id)
+            # Filtrar mensajes por conversación actual si es necesario. El último
+            # separador se resuelve como subconsulta dentro de la misma consulta.
+            if current_conversation_only:
+                stmt = stmt.where(Message.id >= func.coalesce(_last_separator_id(), 0))
 
             # Aplicar filtros adicionales
             if search:
-                query = query.filter(Message.content.ilike(f"%{search}%"))
+                stmt = stmt.where(Message.content.ilike(f"%{search}%"))
             if role:
-                query = query.filter(Message.role == role.lower())
-
-            # Obtener el total de mensajes (para paginación)
-            total = query.count()
+                stmt = stmt.where(Message.role == role.lower())
 
             # Aplicar ordenamiento y paginación
-            db_messages = (
-                query.order_by(Message.created_at.desc())
+            messages = db.execute(
+                stmt.order_by(Message.created_at.desc())
                 .offset(offset)
                 .limit(limit if limit and limit > 0 else 100)
-                .all()
-            )
-
-            # Convertir objetos SQLAlchemy a diccionarios para evitar problemas de sesión
-            messages = [
-                {
-                    "id": msg.id,
-                    "role": msg.role,
-                    "content": msg.content,
-                    "created_at": msg.created_at.isoformat() if msg.created_at else None
-                }
-                for msg in db_messages
-            ]
+            ).mappings().all()
+            total = messages[0]["total"] if messages else 0
 
             return messages, total
 
@@ -198,6 +302,40 @@ def get_all_messages(
         raise SQLAlchemyError(f"Error al obtener mensajes: {str(e)}")
 
 
+def iter_all_messages(
+    current_conversation_only: bool = True,
+) -> Generator[RowMapping, None, None]:
+    """Recorre los mensajes del chat sin cargarlos todos en memoria.
+
+    Usa un cursor del lado del servidor y lee las filas en bloques de 200,
+    en el mismo orden que `get_all_messages` (más recientes primero).
+
+    Args:
+        current_conversation_only: Si es True, solo recorre los mensajes de la conversación actual
+
+    Yields:
+        Filas como mapeos con las claves id, role, content y created_at
+
+    Raises:
+        SQLAlchemyError: Si ocurre un error en la base de datos
+    """
+    _wait_for_pending_writes()
+
+    try:
+        with get_db() as db:
+            stmt: Select = select(Message.id, Message.role, Message.content, Message.created_at)
+            if current_conversation_only:
+                stmt = stmt.where(Message.id >= func.coalesce(_last_separator_id(), 0))
+
+            result = db.execute(
+                stmt.order_by(Message.created_at.desc()).execution_options(yield_per=200)
+            )
+            yield from result.mappings()
+
+    except SQLAlchemyError as e:
+        raise SQLAlchemyError(f"Error al recorrer mensajes: {str(e)}")
+
+
 def format_message_for_display(message: Message, max_width: int = 80) -> str:
     """Formatea un mensaje para mostrarlo en la terminal.
     
@@ -208,8 +346,6 @@ def format_message_for_display(message: Message, max_width: int = 80) -> str:
     Returns:
         String formateado para mostrar en terminal
     """
-    from datetime import timezone
-
     # Convertir a zona horaria local si está en UTC
     created_at = message.created_at
     if created_at.tzinfo == timezone.utc:
@@ -237,6 +373,8 @@ def get_chat_summary() -> dict:
     Returns:
         Diccionario con estadísticas del chat
     """
+    _wait_for_pending_writes()
+
     try:
         with get_db() as db:
             # Obtener estadísticas básicas
@@ -276,6 +414,8 @@ def get_messages_by_role(role: str, limit: Optional[int] = None) -> List[Message
     Raises:
         SQLAlchemyError: Si ocurre un error en la base de datos
     """
+    _wait_for_pending_writes()
+
     try:
         with get_db() as db:
             query = db.query(Message).filter(Message.role == role.lower()).order_by(Message.created_at)
@@ -293,10 +433,11 @@ def clear_chat_history() -> None:
     Raises:
         SQLAlchemyError: Si ocurre un error en la base de datos
     """
+    _wait_for_pending_writes()
+
     try:
         with get_db() as db:
             db.query(Message).delete()
-            db.commit()
     except SQLAlchemyError as e:
         raise SQLAlchemyError(f"Error al limpiar el historial: {str(e)}")
 
@@ -314,15 +455,18 @@ def create_new_conversation() -> bool:
     Raises:
         SQLAlchemyError: Si ocurre un error en la base de datos
     """
+    # El separador debe quedar detrás de los mensajes aún pendientes
+    _wait_for_pending_writes()
+
     try:
         with get_db() as db:
             # Agregar mensaje de sistema como separador
             new_message = Message(
                 role="system",
-                content="--- NUEVA CONVERSACIÓN"
+                content="--- NUEVA CONVERSACIÓN",
+                is_separator=True,
             )
             db.add(new_message)
-            db.commit()
 
         return True
     except SQLAlchemyError as e:
@@ -1,13 +1,20 @@
-import subprocess
+import asyncio
 
+PREFIX = {"user": "**Usuario**:", "assistant": "**Asistente:**"}
 
-def export_markdown(messages):
-    lines = []
+
+def export_markdown_to(messages, fp):
+    separator = ""
     for m in messages:
-        prefix = "**Usuario**:" if m.role == "user" else "**Asistente:**"
-        lines.append(f"{prefix}  \n{m.content}")
-    return "\n\n".join(lines)
+        fp.write(separator)
+        fp.write(PREFIX.get(m['role'], '**System:**'))
+        fp.write("  \n")
+        fp.write(m['content'])
+        separator = "\n\n"
 
-def convert_md_to_pdf(md_file: str, pdf_file: str):
-    subprocess.run(["pandoc", md_file, "-o", pdf_file], check=True)
+async def convert_md_to_pdf(md_file: str, pdf_file: str):
+    proc = await asyncio.create_subprocess_exec("pandoc", md_file, "-o", pdf_file)
+    returncode = await proc.wait()
+    if returncode:
+        raise RuntimeError(f"pandoc terminó con código {returncode}")
 
@@ -4,27 +4,44 @@ Módulo cliente para interactuar con la API de Groq.
 Este módulo maneja la comunicación con la API de Groq, incluyendo el envío de
 mensajes, recepción de respuestas en streaming y manejo de errores.
 """
+import asyncio
+import io
+import json
 import logging
 import os
 import time
+from collections import OrderedDict, deque
 from typing import (
     Any,
+    AsyncGenerator,
     Callable,
+    Deque,
     Dict,
-    Generator,
     List,
     Optional,
+    Tuple,
     cast,
 )
 
+import httpx
 from dotenv import load_dotenv
-from groq import Groq
+from groq import AsyncGroq
 
-# Configurar logging
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
-)
+try:
+    import orjson
+
+    _json_loads: Callable[[str], Any] = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
+# Logger del módulo; solo se configura un handler si se pide con LOG_INIT_GROQ=1
+# para no tocar la configuración del logger raíz de quien importa el módulo
+logger = logging.getLogger(__name__)
+if os.getenv("LOG_INIT_GROQ") == "1":
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s"))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
 
 # Cargar variables de entorno desde .env
 load_dotenv()
@@ -32,20 +49,39 @@ GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 if not GROQ_API_KEY:
     raise ValueError("La API key de Groq no está configurada. Establezca GROQ_API_KEY en el archivo .env")
 
-# Inicializar cliente con manejo de errores
-try:
-    client = Groq(api_key=GROQ_API_KEY)
-except Exception as e:
-    raise RuntimeError(f"Error al inicializar el cliente de Groq: {str(e)}")
+# Configuración HTTP del cliente: un único pool de conexiones keep-alive sobre
+# HTTP/2 reutilizado entre llamadas y un reintento de conexión en el transporte
+HTTP_LIMITS = httpx.Limits(max_connections=50, max_keepalive_connections=20)
+HTTP_TIMEOUT = httpx.Timeout(60.0, connect=5.0)
+HTTP_RETRIES = 1
+
+# Leer el stream SSE en crudo en lugar de validar cada fragmento con pydantic.
+# GROQ_RAW_STREAM=false vuelve al stream tipado del SDK.
+RAW_STREAM = os.getenv("GROQ_RAW_STREAM", "true").lower() in ("true", "1", "yes")
+
+# Cliente asíncrono, creado bajo demanda para el event loop en ejecución
+_async_client: Optional[AsyncGroq] = None
+_async_client_loop: Optional[asyncio.AbstractEventLoop] = None
+
+# Caché LRU en memoria de respuestas sin streaming. Solo se usa con
+# temperaturas bajas, donde la respuesta es prácticamente determinista.
+RESPONSE_CACHE_SIZE = 128
+RESPONSE_CACHE_MAX_TEMPERATURE = 0.2
+RESPONSE_CACHE_CONTEXT = 6
+# Se guarda solo el texto (inmutable); el diccionario de resultado se crea en cada llamada.
+_response_cache: "OrderedDict[Tuple[Any, ...], str]" = OrderedDict()
 
 # Constantes y configuraciones
 DEFAULT_MODEL = "meta-llama/llama-4-scout-17b-16e-instruct"
 DEFAULT_TEMPERATURE = 0.3
 DEFAULT_MAX_TOKENS = 1024
 
-# Prompt del sistema para usar con todos los mensajes
+# Prompt del sistema para usar con todos los mensajes. El SDK serializa el
+# cuerpo de cada petición completo y no admite fragmentos JSON ya serializados,
+# así que el prompt se mantiene como un dict constante compartido entre llamadas.
+SYSTEM_PROMPT_ROLE = "system"
 SYSTEM_PROMPT = {
-    "role": "system",
+    "role": SYSTEM_PROMPT_ROLE,
     "content": (
         "Eres el CEO de una multinacional experta en Python. "
         "Tu misión es guiar a un desarrollador junior con orientación profesional: "
@@ -60,108 +96,207 @@ SYSTEM_PROMPT = {
 CONVERSATION_SEPARATOR = "--- NUEVA CONVERSACIÓN"
 
 
-def stream_response(
+def _get_async_client() -> AsyncGroq:
+    """Devuelve el cliente asíncrono asociado al event loop en ejecución.
+
+    Las conexiones HTTP quedan ligadas al loop que las abrió, por lo que se
+    crea un cliente nuevo cuando cambia el loop (p. ej. entre llamadas a asyncio.run).
+    """
+    global _async_client, _async_client_loop
+    loop = asyncio.get_running_loop()
+    if _async_client is None or _async_client_loop is not loop:
+        # Inicializar cliente con manejo de errores
+        try:
+            _async_client = AsyncGroq(
+                api_key=GROQ_API_KEY,
+                http_client=httpx.AsyncClient(
+                    timeout=HTTP_TIMEOUT,
+                    transport=httpx.AsyncHTTPTransport(
+                        http2=True, limits=HTTP_LIMITS, retries=HTTP_RETRIES
+                    ),
+                ),
+            )
+        except Exception as e:
+            raise RuntimeError(f"Error al inicializar el cliente de Groq: {str(e)}")
+        _async_client_loop = loop
+    return _async_client
+
+
+async def close_client() -> None:
+    """Cierra el cliente asíncrono y sus conexiones si pertenece al loop actual.
+
+    Debe llamarse antes de que termine el event loop (p. ej. al final de la
+    corrutina pasada a asyncio.run).
+    """
+    global _async_client, _async_client_loop
+    if _async_client is not None and _async_client_loop is asyncio.get_running_loop():
+        await _async_client.close()
+    _async_client = None
+    _async_client_loop = None
+
+
+def _prepare_messages(
+    messages: List[Dict[str, str]],
+    max_non_system: int = 20,
+) -> List[Dict[str, str]]:
+    """Asegura el prompt del sistema y limita el historial enviado al modelo.
+
+    Recorre los mensajes una sola vez: conserva el primer mensaje del sistema
+    (o usa `SYSTEM_PROMPT` si no hay ninguno) y los últimos `max_non_system`
+    mensajes de la conversación.
+
+    Args:
+        messages: Lista de mensajes para enviar al modelo
+        max_non_system: Máximo de mensajes de la conversación a conservar
+
+    Returns:
+        Lista con el mensaje del sistema seguido de los mensajes más recientes
+    """
+    system_msg: Optional[Dict[str, str]] = None
+    recent: Deque[Dict[str, str]] = deque(maxlen=max_non_system)
+    get = dict.get
+
+    for msg in messages:
+        if get(msg, 'role') == SYSTEM_PROMPT_ROLE:
+            if system_msg is None:
+                system_msg = msg
+        else:
+            recent.append(msg)
+
+    return [system_msg or SYSTEM_PROMPT, *recent]
+
+
+async def _iter_deltas(**params: Any) -> AsyncGenerator[str, None]:
+    """Transmite el texto de cada fragmento de una respuesta de chat.
+
+    Por defecto lee las líneas SSE en crudo y las decodifica con orjson (o
+    json si no está instalado), evitando construir y validar un modelo
+    pydantic por token. Con `RAW_STREAM` desactivado usa el stream tipado del SDK.
+
+    Args:
+        **params: Parámetros para `chat.completions.create` (sin `stream`)
+
+    Yields:
+        El contenido de texto de cada fragmento ('' si no trae contenido)
+
+    Raises:
+        RuntimeError: Si la API envía un evento de error dentro del stream
+    """
+    client = _get_async_client()
+
+    if not RAW_STREAM:
+        stream = await client.chat.completions.create(stream=True, **params)
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta:
+                yield chunk.choices[0].delta.content or ''
+        return
+
+    async with client.chat.completions.with_streaming_response.create(
+        stream=True, **params
+    ) as response:
+        async for line in response.iter_lines():
+            if not line.startswith("data: "):
+                continue
+            data = line[6:]
+            if data == "[DONE]":
+                break
+
+            event = _json_loads(data)
+            if "error" in event:
+                raise RuntimeError(f"Error en el stream: {event['error']}")
+
+            choices = event.get("choices")
+            if choices:
+                yield choices[0].get("delta", {}).get("content") or ''
+
+
+async def stream_response(
     messages: List[Dict[str, str]],
     model: str = DEFAULT_MODEL,
     temperature: float = DEFAULT_TEMPERATURE,
     max_tokens: int = DEFAULT_MAX_TOKENS,
-    chunk_size: int = 30,
+    flush_size: int = 256,
     on_chunk: Optional[Callable[[str, bool, Dict[str, Any]], bool]] = None,
-) -> Generator[Dict[str, Any], None, None]:
+) -> AsyncGenerator[Dict[str, Any], None]:
     """Envía una solicitud al modelo y transmite la respuesta por stream.
-    
+
+    Mientras se espera cada fragmento de la red el event loop queda libre
+    para otras tareas.
+
     Args:
         messages: Lista de mensajes para enviar al modelo
         model: Modelo a utilizar
         temperature: Temperatura para la generación (0-1)
         max_tokens: Número máximo de tokens a generar
-        chunk_size: Tamaño de los chunks a emitir (en palabras)
+        flush_size: Caracteres acumulados a partir de los cuales se emite un chunk
         on_chunk: Función callback que recibe cada chunk
-        
+
     Yields:
         Diccionarios con partes de la respuesta
     """
-    buffer = []
-    word_count = 0
-
-    # Asegurarse de que tenemos un prompt del sistema
-    if not any(msg.get('role') == 'system' for msg in messages):
-        messages = [SYSTEM_PROMPT] + messages
-
-    # Limitar a un máximo de 20 mensajes para evitar superar el límite de tokens
-    # pero mantener suficiente contexto para la conversación
-    if len(messages) > 21:  # 20 mensajes + sistema prompt
-        # Mantener el sistema prompt y los últimos 20 mensajes
-        system_msgs = [msg for msg in messages if msg.get('role') == 'system']
-        non_system_msgs = [msg for msg in messages if msg.get('role') != 'system']
+    buffer = io.StringIO()
+    buffer_len = 0
+    total_tokens = 0  # estimación acumulada de tokens emitidos
 
-        # Tomar los mensajes más recientes
-        recent_msgs = non_system_msgs[-20:]
-        messages = system_msgs + recent_msgs
+    messages = _prepare_messages(messages)
 
-    logging.debug(f"Enviando {len(messages)} mensajes al modelo")
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"Enviando {len(messages)} mensajes al modelo")
 
     try:
-        # Usamos Any para evitar problemas de tipado específicos de la API de Groq
-        stream = client.chat.completions.create(
+        deltas = _iter_deltas(
             model=model,
             messages=cast(Any, messages),  # Casting explícito para evitar errores de tipo
             temperature=temperature,
             max_completion_tokens=max_tokens,
             top_p=1,
-            stream=True,
         )
 
-        for chunk in stream:
-            if not hasattr(chunk, 'choices') or not chunk.choices or not chunk.choices[0].delta:
-                continue
-
-            content = chunk.choices[0].delta.content or ''
-
+        async for content in deltas:
             # Agregar al buffer para chunks más grandes y procesables
-            buffer.append(content)
-            word_count += len(content.split())
+            buffer.write(content)
+            buffer_len += len(content)
 
-            if word_count >= chunk_size:
-                joined_content = ''.join(buffer)
-                buffer = []
-                word_count = 0
+            if buffer_len >= flush_size:
+                joined_content = buffer.getvalue()
+                buffer = io.StringIO()
+                chunk_tokens = buffer_len >> 2  # ~4 caracteres por token
+                total_tokens += chunk_tokens
+                buffer_len = 0
 
-                result = {
+                yield {
                     'chunk': joined_content,
                     'finished': False,
-                    'usage': {'tokens': len(joined_content) // 4, 'total_tokens': len(joined_content) // 4},
+                    'usage': {'tokens': chunk_tokens, 'total_tokens': total_tokens},
                     'error': None,
                 }
 
-                yield result
-
                 if on_chunk and not on_chunk(joined_content, False, {}):
                     break
 
         # Emitir el buffer restante
-        if buffer:
-            final_chunk = ''.join(buffer)
-            result = {
+        if buffer.tell():
+            final_chunk = buffer.getvalue()
+            chunk_tokens = buffer_len >> 2
+            total_tokens += chunk_tokens
+            yield {
                 'chunk': final_chunk,
                 'finished': True,
-                'usage': {'tokens': len(final_chunk) // 4, 'total_tokens': len(final_chunk) // 4},
+                'usage': {'tokens': chunk_tokens, 'total_tokens': total_tokens},
                 'error': None,
             }
 
-            yield result
-
             if on_chunk:
                 on_chunk(final_chunk, True, {})
 
     except Exception as e:
         error_msg = f"Error en la generación: {str(e)}"
-        logging.error(error_msg)
+        logger.error(error_msg)
 
         yield {
             'chunk': '',
             'finished': True,
-            'usage': {'tokens': 0, 'total_tokens': 0},
+            'usage': {'tokens': 0, 'total_tokens': total_tokens},
             'error': error_msg
         }
 
@@ -169,7 +304,7 @@ def stream_response(
             on_chunk('', True, {'error': error_msg})
 
 
-def stream_chat_response(
+async def stream_chat_response(
     question: str,
     history: Optional[List[Dict[str, str]]] = None,
     on_token: Optional[Callable[[str], None]] = None
@@ -185,7 +320,7 @@ def stream_chat_response(
     Returns:
         Respuesta completa generada por el modelo
     """
-    full_response = ""
+    tokens: List[str] = []
 
     # Preparar mensajes incluyendo historial si está disponible
     if history:
@@ -194,15 +329,17 @@ def stream_chat_response(
         if len(history) > 40:  # Ampliamos el límite ya que el filtrado principal se hace en chat_db
             history = history[-40:]
 
-        # Verificamos si hay algún separador de nueva conversación en el historial
-        # y eliminamos todo lo anterior al separador
-        for i, msg in enumerate(history):
-            content = msg.get("content")
-            is_separator = (msg.get("role") == "system" and
-                           isinstance(content, str) and
-                           CONVERSATION_SEPARATOR in content)
-            if is_separator:
-                # Solo mantener mensajes desde este separador en adelante
+        # Buscamos el último separador de nueva conversación recorriendo el
+        # historial desde el final y eliminamos todo lo anterior a él.
+        # Solo se mira el contenido de los mensajes del sistema.
+        get = dict.get
+        for i in range(len(history) - 1, -1, -1):
+            msg = history[i]
+            if get(msg, "role") != "system":
+                continue
+            content = get(msg, "content")
+            if type(content) is str and content.startswith(CONVERSATION_SEPARATOR):
+                # Solo mantener mensajes posteriores al separador
                 history = history[i+1:]
                 break
 
@@ -212,50 +349,51 @@ def stream_chat_response(
             include_next = True
 
             for msg in history:
-                content = msg.get('content')
-                # Verifica que content sea un string y no sea None antes de llamar a startswith
-                if isinstance(content, str) and CONVERSATION_SEPARATOR in content:
+                content = get(msg, 'content')
+                # Verifica que content sea un string y no sea None antes de buscar el separador
+                if type(content) is str and CONVERSATION_SEPARATOR in content:
                     safe_history = []  # Si encontramos un separador, reiniciamos
                     continue
                 if include_next:
                     safe_history.append(msg)
             history = safe_history
 
-        messages = [SYSTEM_PROMPT] + history + [{"role": "user", "content": question}]
-    else:
-        messages = [
-            SYSTEM_PROMPT,
-            {"role": "user", "content": question},
-        ]
+    # Construir la lista de mensajes de una sola vez, sin listas intermedias
+    messages = [SYSTEM_PROMPT, *(history or ()), {"role": "user", "content": question}]
 
     try:
         # Usar ventana de contexto amplia para este modelo específico
         # Usar Any para evitar problemas de tipado con la API de Groq
-        completion = client.chat.completions.create(
+        deltas = _iter_deltas(
             model=DEFAULT_MODEL,
             messages=cast(Any, messages),  # Cast explícito para compatibilidad
             temperature=DEFAULT_TEMPERATURE,
             max_completion_tokens=DEFAULT_MAX_TOKENS,
             top_p=1,
-            stream=True,
         )
 
-        for chunk in completion:
-            # Verificar que tenga el atributo choices antes de usarlo
-            if hasattr(chunk, 'choices') and chunk.choices and hasattr(chunk.choices[0], 'delta'):
-                token = chunk.choices[0].delta.content or ""
-                full_response += token
-                if on_token:
-                    on_token(token)
+        async for token in deltas:
+            tokens.append(token)
+            if on_token:
+                on_token(token)
 
-        return full_response
+        return "".join(tokens)
     except Exception as e:
         error_msg = f"Error en la generación: {str(e)}"
-        logging.error(error_msg)
+        logger.error(error_msg)
         raise
 
 
-def get_chat_response(
+def _chat_result(response: str) -> Dict[str, Any]:
+    """Construye el diccionario de resultado de `get_chat_response`."""
+    return {
+        'response': response,
+        'usage': {'tokens': len(response) // 4, 'total_tokens': len(response) // 4},
+        'error': None
+    }
+
+
+async def get_chat_response(
     messages: List[Dict[str, str]],
     model: str = DEFAULT_MODEL,
     temperature: float = DEFAULT_TEMPERATURE,
@@ -274,25 +412,28 @@ def get_chat_response(
     """
     # Preparamos para guardar los resultados
     
-    # Asegurarse de que tenemos un prompt del sistema
-    if not any(msg.get('role') == 'system' for msg in messages):
-        messages = [SYSTEM_PROMPT] + messages
-
-    # Limitar a un máximo de 20 mensajes para evitar superar el límite de tokens
-    # pero mantener suficiente contexto para la conversación
-    if len(messages) > 21:  # 20 mensajes + sistema prompt
-        # Mantener el sistema prompt y los últimos 20 mensajes
-        system_msgs = [msg for msg in messages if msg.get('role') == 'system']
-        non_system_msgs = [msg for msg in messages if msg.get('role') != 'system']
-
-        # Tomar los mensajes más recientes
-        recent_msgs = non_system_msgs[-20:]
-        messages = system_msgs + recent_msgs
+    messages = _prepare_messages(messages)
+
+    # Clave de caché: los últimos mensajes (incluida la pregunta) y la configuración
+    cache_key: Optional[Tuple[Any, ...]] = None
+    if temperature <= RESPONSE_CACHE_MAX_TEMPERATURE:
+        cache_key = (
+            model,
+            temperature,
+            max_tokens,
+            tuple((m['role'], m['content']) for m in messages[-RESPONSE_CACHE_CONTEXT:]),
+        )
+        cached = _response_cache.get(cache_key)
+        if cached is not None:
+            _response_cache.move_to_end(cache_key)
+            logger.debug("Respuesta obtenida de la caché")
+            return _chat_result(cached)
 
-    logging.debug(f"Enviando {len(messages)} mensajes al modelo sin streaming")
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"Enviando {len(messages)} mensajes al modelo sin streaming")
 
     try:
-        completion = client.chat.completions.create(
+        completion = await _get_async_client().chat.completions.create(
             model=model,
             messages=cast(Any, messages),  # Casting explícito para compatibilidad de tipos
             temperature=temperature,
@@ -302,15 +443,17 @@ def get_chat_response(
 
         response = completion.choices[0].message.content or ""
 
-        return {
-            'response': response,
-            'usage': {'tokens': len(response) // 4, 'total_tokens': len(response) // 4},
-            'error': None
-        }
+        # Solo se guardan en caché las respuestas correctas
+        if cache_key is not None:
+            _response_cache[cache_key] = response
+            if len(_response_cache) > RESPONSE_CACHE_SIZE:
+                _response_cache.popitem(last=False)
+
+        return _chat_result(response)
 
     except Exception as e:
         error_msg = f"Error al comunicarse con la API: {str(e)}"
-        logging.error(error_msg)
+        logger.error(error_msg)
 
         return {
             'response': "",
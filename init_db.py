@@ -1,13 +1,34 @@
 """
 Script para inicializar la base de datos.
 """
-from chat_db import Base, engine
+from sqlalchemy import text
+
+from chat_db import Base, Message, engine
+
+
+def upgrade_schema():
+    """Aplica a una tabla existente las columnas e índices añadidos después de crearla."""
+    with engine.begin() as conn:
+        conn.execute(text(
+            "ALTER TABLE messages "
+            "ADD COLUMN IF NOT EXISTS is_separator BOOLEAN NOT NULL DEFAULT FALSE"
+        ))
+        # Marcar los separadores guardados antes de existir la columna
+        conn.execute(text(
+            "UPDATE messages SET is_separator = TRUE "
+            "WHERE NOT is_separator AND role = 'system' "
+            "AND content LIKE '--- NUEVA CONVERSACIÓN%'"
+        ))
+
+    for index in Message.__table__.indexes:
+        index.create(bind=engine, checkfirst=True)
 
 
 def init_db():
     """Inicializa la base de datos creando todas las tablas."""
     print("Creando tablas en la base de datos...")
     Base.metadata.create_all(bind=engine)
+    upgrade_schema()
     print("¡Base de datos inicializada correctamente!")
 
 if __name__ == "__main__":
@@ -1,16 +1,15 @@
 """
 Script para mantener una sesión interactiva con el asistente.
 """
+import asyncio
 import datetime
+import io
 import os
-import sys
 
 from rich.console import Console
 from rich.panel import Panel
 from rich.prompt import Prompt
 
-from app import CONFIG, app
-
 console = Console()
 
 # Cargar variables de entorno
@@ -58,6 +57,8 @@ def clear_conversation():
 
 def show_model_info():
     """Muestra información sobre el modelo y configuración actual"""
+    from app import CONFIG
+
     model_info = f"""
     [bold]Modelo:[/bold] {CONFIG['default_model']}
     [bold]Temperatura:[/bold] {CONFIG['default_temperature']} (0.0=preciso, 1.0=creativo)
@@ -67,28 +68,33 @@ def show_model_info():
     """
     console.print(Panel(model_info, title="⚙️ Configuración del modelo", border_style="green"))
 
+def _build_markdown(messages, exported_at):
+    """Construye el contenido markdown de la conversación"""
+    buf = io.StringIO()
+    buf.write("# Chat con LLaMA-4 Scout | Groq API\n\n")
+    buf.write(f"Fecha: {exported_at.strftime('%Y-%m-%d %H:%M')}\n\n")
+
+    # Agregar cada mensaje al contenido
+    for msg in messages:
+        role = "Usuario" if msg['role'] == "user" else "Asistente"
+        buf.write(f"## {role}\n\n{msg['content']}\n\n*{msg['created_at']}*\n\n---\n\n")
+
+    return buf.getvalue()
+
 def export_to_markdown(filename=None):
     """Exporta la conversación actual a un archivo markdown"""
     try:
         # Importamos aquí para evitar referencias circulares
-        from chat_db import get_all_messages
-
-        # Obtener todos los mensajes de la base de datos
-        messages, total = get_all_messages(limit=1000)  # Obtenemos hasta 1000 mensajes
+        from chat_db import iter_all_messages
 
-        # Crear el contenido del archivo markdown
-        content = "# Chat con LLaMA-4 Scout | Groq API\n\n"
-        content += f"Fecha: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M')}\n\n"
+        now = datetime.datetime.now()
 
-        # Agregar cada mensaje al contenido
-        for msg in messages:
-            role = "Usuario" if msg['role'] == "user" else "Asistente"
-            content += f"## {role}\n\n{msg['content']}\n\n"
-            content += f"*{msg['created_at']}*\n\n---\n\n"
+        # Crear el contenido del archivo markdown leyendo los mensajes por bloques
+        content = _build_markdown(iter_all_messages(), now)
 
         # Definir el nombre del archivo si no se especificó
         if not filename:
-            filename = f"chat_llama4_export_{datetime.datetime.now().strftime('%Y%m%d_%H%M')}.md"
+            filename = f"chat_llama4_export_{now.strftime('%Y%m%d_%H%M')}.md"
 
         # Asegurar que el archivo tenga extensión .md
         if not filename.lower().endswith('.md'):
@@ -108,97 +114,106 @@ def export_to_markdown(filename=None):
 def export_to_pdf(filename=None):
     """Exporta la conversación actual a un archivo PDF"""
     try:
-        # Primero exportamos a markdown
-        temp_md = f"temp_export_{datetime.datetime.now().strftime('%Y%m%d_%H%M')}.md"
-        if export_to_markdown(temp_md):
-            # Definir el nombre del archivo PDF si no se especificó
-            if not filename:
-                filename = f"chat_llama4_export_{datetime.datetime.now().strftime('%Y%m%d_%H%M')}.pdf"
-
-            # Asegurar que el archivo tenga extensión .pdf
-            if not filename.lower().endswith('.pdf'):
-                filename += '.pdf'
-
-            # Importar las librerías necesarias para la conversión a PDF
-            try:
-                from weasyprint import HTML  # type: ignore
-
-                # Crear HTML intermedio con estilos
-                html_content = """
-                <!DOCTYPE html>
-                <html>
-                <head>
-                    <meta charset="UTF-8">
-                    <title>Chat Export</title>
-                    <style>
-                        body { font-family: Arial, sans-serif; margin: 40px; }
-                        h1 { color: #2c3e50; }
-                        h2 { color: #3498db; margin-top: 20px; }
-                        .user { background-color: #f8f9fa; padding: 10px; border-left: 4px solid #3498db; }
-                        .assistant { background-color: #f0f4f8; padding: 10px; border-left: 4px solid #2ecc71; }
-                        .timestamp { color: #7f8c8d; font-size: 0.8em; }
-                        hr { border: 0; height: 1px; background: #ddd; margin: 20px 0; }
-                    </style>
-                </head>
-                <body>
-                """
-
-                # Leer el contenido del archivo markdown
-                with open(temp_md, 'r', encoding='utf-8') as f:
-                    md_content = f.read()
-
-                # Procesar el markdown a HTML
-                from markdown import markdown
-                html_content += markdown(md_content)
-                html_content += "</body></html>"
-
-                # Crear un archivo HTML temporal
-                temp_html = temp_md.replace('.md', '.html')
-                with open(temp_html, 'w', encoding='utf-8') as f:
-                    f.write(html_content)
-
-                # Convertir HTML a PDF
-                HTML(temp_html).write_pdf(filename)
-
-                # Eliminar archivos temporales
-                try:
-                    os.remove(temp_md)
-                    os.remove(temp_html)
-                except Exception:
-                    pass
-
-                console.print(f"[green]✓[/green] Conversación exportada a [bold]{filename}[/bold]")
-                return True
-
-            except ImportError:
-                console.print("[yellow]⚠️ Se requiere WeasyPrint para exportar a PDF. Usando solo markdown.[/yellow]")
-                # Renombrar el archivo temporal
-                os.rename(temp_md, filename.replace('.pdf', '.md'))
-                console.print(f"[green]✓[/green] Conversación exportada a [bold]{filename.replace('.pdf', '.md')}[/bold]")
-                return True
+        # Importamos aquí para evitar referencias circulares
+        from chat_db import iter_all_messages
 
-        return False
+        now = datetime.datetime.now()
+
+        # Construir el markdown en memoria, sin archivos temporales
+        md_content = _build_markdown(iter_all_messages(), now)
+
+        # Definir el nombre del archivo PDF si no se especificó
+        if not filename:
+            filename = f"chat_llama4_export_{now.strftime('%Y%m%d_%H%M')}.pdf"
+
+        # Asegurar que el archivo tenga extensión .pdf
+        if not filename.lower().endswith('.pdf'):
+            filename += '.pdf'
+
+        # Importar las librerías necesarias para la conversión a PDF
+        try:
+            from weasyprint import HTML  # type: ignore
+
+            # Crear HTML intermedio con estilos
+            html_head = """
+            <!DOCTYPE html>
+            <html>
+            <head>
+                <meta charset="UTF-8">
+                <title>Chat Export</title>
+                <style>
+                    body { font-family: Arial, sans-serif; margin: 40px; }
+                    h1 { color: #2c3e50; }
+                    h2 { color: #3498db; margin-top: 20px; }
+                    .user { background-color: #f8f9fa; padding: 10px; border-left: 4px solid #3498db; }
+                    .assistant { background-color: #f0f4f8; padding: 10px; border-left: 4px solid #2ecc71; }
+                    .timestamp { color: #7f8c8d; font-size: 0.8em; }
+                    hr { border: 0; height: 1px; background: #ddd; margin: 20px 0; }
+                </style>
+            </head>
+            <body>
+            """
+
+            # Procesar el markdown a HTML
+            from markdown import markdown
+            html_content = "".join((html_head, markdown(md_content), "</body></html>"))
+
+            # Convertir HTML a PDF directamente desde memoria
+            HTML(string=html_content).write_pdf(filename)
+
+            console.print(f"[green]✓[/green] Conversación exportada a [bold]{filename}[/bold]")
+            return True
+
+        except ImportError:
+            console.print("[yellow]⚠️ Se requiere WeasyPrint para exportar a PDF. Usando solo markdown.[/yellow]")
+            md_filename = filename.replace('.pdf', '.md')
+            with open(md_filename, 'w', encoding='utf-8') as f:
+                f.write(md_content)
+            console.print(f"[green]✓[/green] Conversación exportada a [bold]{md_filename}[/bold]")
+            return True
 
     except Exception as e:
         console.print(f"[red]Error al exportar a PDF: {str(e)}[/red]")
         return False
 
-def process_query_with_streaming(query, temperature, max_tokens, model, console):
+def _shutdown_loop(loop):
+    """Cancela las tareas pendientes, cierra el cliente de Groq y el event loop"""
+    from groq_client import close_client
+
+    try:
+        pending = asyncio.all_tasks(loop)
+        for task in pending:
+            task.cancel()
+        # Sin tareas, gather() crearía su futuro en el loop por defecto y no en `loop`
+        if pending:
+            loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+        loop.run_until_complete(close_client())
+    finally:
+        loop.close()
+
+def _run_query(loop, coro):
+    """Ejecuta una pregunta en el loop; Ctrl+C solo interrumpe esa pregunta"""
+    task = loop.create_task(coro)
+    try:
+        return loop.run_until_complete(task)
+    except KeyboardInterrupt:
+        # Cancelar la tarea y esperar a que termine dentro del mismo loop
+        task.cancel()
+        loop.run_until_complete(asyncio.gather(task, return_exceptions=True))
+        # Si la generación no llegó a gestionar la interrupción, avisamos aquí
+        if task.cancelled() or isinstance(task.exception(), KeyboardInterrupt):
+            console.print("\n[red]Pregunta interrumpida por el usuario[/red]")
+        return False
+
+async def process_query_with_streaming(query, temperature, max_tokens, model, console):
     """
     Procesa una pregunta y muestra la respuesta en streaming.
-    Esta función enviará los parámetros a la CLI principal.
+    Llama directamente al manejador del comando ask, sin pasar por la CLI.
     """
     try:
-        # Construir los argumentos y llamar al comando ask
-        sys.argv = [
-            "app.py", "ask", query,
-            "--temperature", str(temperature),
-            "--max-tokens", str(max_tokens),
-            "--model", model
-        ]
-        app()
-        # La respuesta se maneja directamente por app()
-        return True
+        from app import ask_async
+
+        return await ask_async(query, temperature=temperature, max_tokens=max_tokens, model=model)
     except Exception as e:
         console.print(f"[red]Error al procesar la pregunta: {str(e)}[/red]")
         if os.getenv("DEBUG"):
@@ -208,6 +223,9 @@ def process_query_with_streaming(query, temperature, max_tokens, model, console)
 
 def run_interactive():
     """Mantiene una sesión interactiva con el asistente."""
+    # Importamos aquí para no cargar el cliente de Groq ni la base de datos al importar el módulo
+    from app import CONFIG
+
     # Configuración por defecto para esta sesión
     session_config = {
         "temperature": CONFIG.get('default_temperature', 0.3),
@@ -230,6 +248,11 @@ def run_interactive():
     console.print("\n[bold cyan]Escribe /help para ver todos los comandos disponibles[/bold cyan]")
     console.print("[italic]Para hacer una pregunta, solo escribe y presiona Enter[/italic]\n")
 
+    # Un único event loop para toda la sesión: el cliente de Groq reutiliza sus
+    # conexiones entre preguntas. El prompt se lee fuera del loop para que
+    # Ctrl+C siga saliendo de inmediato.
+    loop = asyncio.new_event_loop()
+
     try:
         while True:
             # Solicitar input al usuario
@@ -304,17 +327,14 @@ def run_interactive():
                 console.print(Panel("[bold yellow]⌛ Pregunta recibida. Generando respuesta...[/bold yellow]",
                                    expand=False, border_style="yellow"))
 
-                # Mostrar un spinner mientras procesa con indicación de progreso
-                with console.status("[bold green]Conectando con modelo LLaMA-4 Scout... Por favor espera[/bold green]",
-                                    spinner="dots12"):
-                    # Procesar la pregunta usando nuestra función auxiliar
-                    process_query_with_streaming(
-                        query=user_input,
-                        temperature=session_config.get("temperature", 0.3),
-                        max_tokens=session_config.get("max_tokens", 8192),
-                        model=session_config.get("model", "meta-llama/llama-4-scout-17b-16e-instruct"),
-                        console=console
-                    )
+                # Procesar la pregunta usando nuestra función auxiliar
+                _run_query(loop, process_query_with_streaming(
+                    query=user_input,
+                    temperature=session_config.get("temperature", 0.3),
+                    max_tokens=session_config.get("max_tokens", 8192),
+                    model=session_config.get("model", "meta-llama/llama-4-scout-17b-16e-instruct"),
+                    console=console
+                ))
 
     except KeyboardInterrupt:
         console.print("\n[bold]¡Hasta luego! 👋[/bold]")
@@ -323,6 +343,8 @@ def run_interactive():
         if os.getenv("DEBUG"):
             import traceback
             console.print(traceback.format_exc(), style="red")
+    finally:
+        _shutdown_loop(loop)
 
 if __name__ == "__main__":
     run_interactive()